@@ -1,32 +1,53 @@
-import marshmallow as ma
+import time
 
-from app.utility.base_object import BaseObject
-from app.objects.secondclass.c_link import LinkSchema
+import marshmallow as ma
 
 
 class ProcessNodeSchema(ma.Schema):
     pid = ma.fields.Integer()
-    link = ma.fields.Nested(LinkSchema())
-    parent_guid = ma.fields.String()
+    link_id = ma.fields.String()
+    host = ma.fields.String()
+    parent_guid = ma.fields.String(allow_none=True)
     child_guids = ma.fields.List(ma.fields.String())
+    last_seen = ma.fields.Float(allow_none=True)
 
     @ma.post_load()
     def build_pidnode(self, data, **_):
         return ProcessNode(**data)
 
 
-class ProcessNode(BaseObject):
+class ProcessNode:
     """
     ProcessNodes are used within ProcessTrees to represent processes and their parent/child relationships.
+    Only the id of the link that discovered the process is kept; the link itself is looked up on demand.
+    last_seen is the last time the process, or any of its descendants, was added to the ProcessTree.
     """
 
-    def __init__(self, pid, link, parent_guid=None, child_guids=None):
-        super().__init__()
+    __slots__ = ('pid', 'link_id', 'host', 'parent_guid', 'child_guids', 'last_seen')
+
+    def __init__(self, pid, link_id, host, parent_guid=None, child_guids=None, last_seen=None):
         self.pid = pid
-        self.link = link
+        self.link_id = link_id
+        self.host = host
         self.parent_guid = parent_guid
-        self.child_guids = child_guids if child_guids else []
+        self.child_guids = set(child_guids) if child_guids else set()
+        self.last_seen = last_seen or time.time()
+
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __setstate__(self, state):
+        if 'link' in state:
+            # nodes pickled before only the link id was kept
+            state = dict(state, link_id=state['link'].id, host=state['link'].host)
+        for slot in self.__slots__:
+            setattr(self, slot, state.get(slot))
+        self.child_guids = set(self.child_guids or ())
+        self.last_seen = self.last_seen or time.time()
+
+    async def find_link(self, app_svc):
+        return await app_svc.find_link(self.link_id)
 
     def add_child(self, child_guid, child_link):
-        if self.link.host == child_link.host and child_guid not in self.child_guids:
-            self.child_guids.append(child_guid)
+        if self.host == child_link.host:
+            self.child_guids.add(child_guid)
@@ -1,5 +1,6 @@
+import time
+
 import marshmallow as ma
-from random import randint
 
 from app.utility.base_object import BaseObject
 from app.objects.interfaces.i_object import FirstClassObjectInterface
@@ -22,20 +23,30 @@ class ProcessTree(FirstClassObjectInterface, BaseObject):
     Each ProcessTree is unique to a host to ensure that processes aren't being incorrectly linked across hosts.
     As Windows allows the reuse of PIDs, processes are uniquely identified within the ProcessTree using the matching
     Sysmon GUID for the process.
+    A ProcessTree is identified by its host alone, so storing a tree for a host that already has one returns the
+    existing tree.
     """
 
     schema = ProcessTreeSchema()
 
     @property
     def unique(self):
-        return self.host + str(self.ptree_id)
+        return self.host
 
     def __init__(self, host, ptree_id=None, pid_to_guids_map=None, guid_to_processnode_map=None):
         super().__init__()
-        self.ptree_id = ptree_id if ptree_id else randint(0, 999999)
+        self.ptree_id = ptree_id
         self.host = host
-        self.pid_to_guids_map = pid_to_guids_map if pid_to_guids_map else dict()
+        self.pid_to_guids_map = {pid: set(guids) for pid, guids in (pid_to_guids_map or dict()).items()}
         self.guid_to_processnode_map = guid_to_processnode_map if guid_to_processnode_map else dict()
+        self._root_guids = dict()
+        self._link_to_guids = self._index_links()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.pid_to_guids_map = {pid: set(guids) for pid, guids in self.pid_to_guids_map.items()}
+        self._root_guids = dict()
+        self._link_to_guids = self._index_links()
 
     async def add_processnode(self, guid, pid, link, parent_guid=None):
         """
@@ -43,16 +54,36 @@ class ProcessTree(FirstClassObjectInterface, BaseObject):
         When the Child Process Ability is run and produces a process as a result, the process is added as a ProcessNode,
         and the parent/child relationships of that ProcessNode and related ProcessNodes are updated accordingly.
         """
-        processnode = ProcessNode(pid=pid, link=link, parent_guid=parent_guid)
+        if parent_guid and self._root_guids.get(guid) == guid:
+            # a process cached as a root, e.g. as the missing parent of a known process, now has a parent of its own
+            self._root_guids.clear()
+        existing = self.guid_to_processnode_map.get(guid)
+        child_guids = None
+        if existing:
+            # a process found again, e.g. by overlapping scans, keeps the children already known for it
+            child_guids = existing.child_guids
+            parent_guid = parent_guid or existing.parent_guid
+            if existing.parent_guid != parent_guid:
+                # re-parenting a known process changes the root of all of its descendants
+                self._root_guids.clear()
+                old_parent = self.guid_to_processnode_map.get(existing.parent_guid)
+                if old_parent:
+                    old_parent.child_guids.discard(guid)
+            self.pid_to_guids_map.get(existing.pid, set()).discard(guid)
+            self._link_to_guids.get(existing.link_id, set()).discard(guid)
+
+        processnode = ProcessNode(pid=pid, link_id=link.id, host=link.host, parent_guid=parent_guid,
+                                  child_guids=child_guids)
         self.guid_to_processnode_map[guid] = processnode
+        self.pid_to_guids_map.setdefault(pid, set()).add(guid)
+        self._link_to_guids.setdefault(link.id, set()).add(guid)
 
-        if pid in self.pid_to_guids_map:
-            self.pid_to_guids_map[pid].append(guid)
-        else:
-            self.pid_to_guids_map[pid] = [guid]
-
-        if parent_guid:
-            self.guid_to_processnode_map[parent_guid].add_child(guid, link)
+        parent = self.guid_to_processnode_map.get(parent_guid)
+        if parent:
+            parent.add_child(guid, link)
+        now = time.time()
+        for ancestor_guid in self._ancestry(guid):
+            self.guid_to_processnode_map[ancestor_guid].last_seen = now
 
     async def find_original_processes_by_pid(self, pid):
         """
@@ -61,16 +92,7 @@ class ProcessTree(FirstClassObjectInterface, BaseObject):
         In the case of multiple PIDs being returned, it is up to the caller/user to determine which of the returned PIDs
         is the desired one.
         """
-        original_guids = []
-        if pid in self.pid_to_guids_map:
-            guids = self.pid_to_guids_map[pid]
-            for guid in guids:
-                original_guid = guid
-                parent_guid = await self.find_parent_guid(original_guid)
-                while parent_guid is not None:
-                    original_guid = parent_guid
-                    parent_guid = await self.find_parent_guid(original_guid)
-                original_guids.append(original_guid)
+        original_guids = [self._find_root_guid(guid) for guid in self.pid_to_guids_map.get(pid, set())]
         return await self.convert_guids_to_pids(original_guids)
 
     async def find_parent_guid(self, guid):
@@ -78,13 +100,140 @@ class ProcessTree(FirstClassObjectInterface, BaseObject):
             return self.guid_to_processnode_map[guid].parent_guid
         return None
 
+    async def find_subtree(self, guid):
+        """
+        Returns the GUIDs of the given process and all of its descendants, in breadth-first order.
+        """
+        if guid not in self.guid_to_processnode_map:
+            return []
+        subtree = [guid]
+        seen = {guid}
+        for node_guid in subtree:
+            for child_guid in sorted(self.guid_to_processnode_map[node_guid].child_guids):
+                if child_guid in self.guid_to_processnode_map and child_guid not in seen:
+                    seen.add(child_guid)
+                    subtree.append(child_guid)
+        return subtree
+
+    async def find_ancestry(self, guid):
+        """
+        Returns the GUIDs on the path from the given process up to its top-level (original) process.
+        """
+        return self._ancestry(guid)
+
+    async def count_descendants(self, guid):
+        return max(len(await self.find_subtree(guid)) - 1, 0)
+
+    async def find_guids_by_link(self, link_id):
+        """
+        Returns the GUIDs of the processes that were discovered by the given link.
+        """
+        return sorted(self._link_to_guids.get(link_id, set()))
+
+    async def evict(self, max_age=None, max_nodes=None, now=None):
+        """
+        Removes the least recently used processes, each together with all of its descendants, and returns the removed
+        ProcessNodes keyed by GUID. Processes not touched for more than max_age seconds are removed, then the least
+        recently used ones until no more than max_nodes processes remain. The processes on the path to the most
+        recently added process are only ever removed for their age.
+        """
+        if not self.guid_to_processnode_map:
+            return dict()
+        now = now or time.time()
+        children = dict()
+        for guid, processnode in self.guid_to_processnode_map.items():
+            children.setdefault(processnode.parent_guid, []).append(guid)
+        newest = max(processnode.last_seen for processnode in self.guid_to_processnode_map.values())
+        evicted = dict()
+        for last_seen, guid in sorted((p.last_seen, g) for g, p in self.guid_to_processnode_map.items()):
+            if guid in evicted:
+                continue
+            expired = max_age is not None and now - last_seen > max_age
+            oversized = max_nodes is not None and len(self.guid_to_processnode_map) > max_nodes and last_seen < newest
+            if not expired and not oversized:
+                break
+            self._evict_subtree(guid, children, evicted)
+        if evicted:
+            self._root_guids.clear()
+        return evicted
+
+    async def restore(self, processnodes, now=None):
+        """
+        Re-adds previously evicted ProcessNodes, keyed by GUID, and returns the GUIDs that were restored.
+        Processes that the tree has learned about again since their eviction keep their current ProcessNode.
+        """
+        now = now or time.time()
+        restored = [guid for guid in processnodes if guid not in self.guid_to_processnode_map]
+        for guid in restored:
+            processnode = processnodes[guid]
+            processnode.last_seen = now
+            self.guid_to_processnode_map[guid] = processnode
+            self.pid_to_guids_map.setdefault(processnode.pid, set()).add(guid)
+            self._link_to_guids.setdefault(processnode.link_id, set()).add(guid)
+        for guid in restored:
+            parent = self.guid_to_processnode_map.get(processnodes[guid].parent_guid)
+            if parent and parent.host == processnodes[guid].host:
+                parent.child_guids.add(guid)
+        if restored:
+            self._root_guids.clear()
+        return restored
+
     async def convert_guids_to_pids(self, guids):
-        pids = []
-        for guid in guids:
-            for pid in self.pid_to_guids_map:
-                if guid in self.pid_to_guids_map[pid]:
-                    pids.append(pid)
-        return pids
+        return [self.guid_to_processnode_map[guid].pid for guid in guids if guid in self.guid_to_processnode_map]
+
+    def _index_links(self):
+        link_to_guids = dict()
+        for guid, processnode in self.guid_to_processnode_map.items():
+            link_to_guids.setdefault(processnode.link_id, set()).add(guid)
+        return link_to_guids
+
+    def _ancestry(self, guid):
+        ancestry = []
+        seen = set()
+        while guid in self.guid_to_processnode_map and guid not in seen:
+            seen.add(guid)
+            ancestry.append(guid)
+            guid = self.guid_to_processnode_map[guid].parent_guid
+        return ancestry
+
+    def _evict_subtree(self, guid, children, evicted):
+        parent = self.guid_to_processnode_map.get(self.guid_to_processnode_map[guid].parent_guid)
+        if parent:
+            parent.child_guids.discard(guid)
+        stack = [guid]
+        while stack:
+            subtree_guid = stack.pop()
+            if subtree_guid in evicted or subtree_guid not in self.guid_to_processnode_map:
+                continue
+            evicted[subtree_guid] = self._remove_processnode(subtree_guid)
+            stack.extend(children.get(subtree_guid, ()))
+
+    def _remove_processnode(self, guid):
+        processnode = self.guid_to_processnode_map.pop(guid)
+        for index, key in ((self.pid_to_guids_map, processnode.pid), (self._link_to_guids, processnode.link_id)):
+            guids = index.get(key, set())
+            guids.discard(guid)
+            if not guids:
+                index.pop(key, None)
+        return processnode
+
+    def _find_root_guid(self, guid):
+        """
+        Returns the top-level ancestor of the process, caching the result for every process on the path to it.
+        """
+        path = []
+        while guid not in self._root_guids:
+            parent_guid = self.guid_to_processnode_map[guid].parent_guid if guid in self.guid_to_processnode_map \
+                else None
+            if parent_guid is None:
+                self._root_guids[guid] = guid
+                break
+            path.append(guid)
+            guid = parent_guid
+        root_guid = self._root_guids[guid]
+        for path_guid in path:
+            self._root_guids[path_guid] = root_guid
+        return root_guid
 
     def store(self, ram):
         existing = self.retrieve(ram['processtrees'], self.unique)
@@ -0,0 +1,45 @@
+class RelationshipIndex:
+    """
+    Indexes relationships by their source value, and by their edge and source value, so that facts can be matched
+    against the relationships collected so far without scanning all of them.
+    Source values are stripped once, as relationships are added, and lookups strip the value being looked up.
+    """
+
+    def __init__(self, relationships=None):
+        self.relationships = []
+        self._indexed = set()
+        self._by_source = dict()
+        self._by_edge_source = dict()
+        self.extend(relationships or [])
+
+    def extend(self, relationships):
+        """
+        Adds relationships to the index, skipping any relationship that has already been added.
+        """
+        for relationship in relationships:
+            if id(relationship) in self._indexed:
+                continue
+            self._indexed.add(id(relationship))
+            self.relationships.append(relationship)
+            source = self.strip(relationship.source.value)
+            self._by_source.setdefault(source, []).append(relationship)
+            self._by_edge_source.setdefault((relationship.edge, source), []).append(relationship)
+
+    def find(self, source_value, edge=None):
+        """
+        Returns the relationships with the given source value, and edge if given, in the order they were added.
+        """
+        source = self.strip(source_value)
+        if edge:
+            return self._by_edge_source.get((edge, source), [])
+        return self._by_source.get(source, [])
+
+    @staticmethod
+    def strip(value):
+        return value.strip() if isinstance(value, str) else value
+
+    def __len__(self):
+        return len(self.relationships)
+
+    def __iter__(self):
+        return iter(self.relationships)
@@ -0,0 +1,60 @@
+import codecs
+import json
+from base64 import b64decode
+from itertools import chain
+
+JSON_VALUE_DELIMITERS = ' \t\r\n,]'
+
+
+def iter_decoded_chunks(encoded, chunk_size=65536):
+    """
+    Decodes base64 encoded text a chunk at a time, so the full decoded text is never held in memory.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    chunk_size -= chunk_size % 4
+    for i in range(0, len(encoded), chunk_size):
+        yield decoder.decode(b64decode(encoded[i:i + chunk_size]))
+    yield decoder.decode(b'', final=True)
+
+
+def iter_json_array(chunks):
+    """
+    Yields the items of a JSON array read from an iterable of text chunks, one item at a time.
+    An item is only yielded once the character following it has been read, as a number cut off by the end of a chunk
+    (e.g. 15 of 15.0) is itself valid JSON.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    opened = False
+    for chunk in chain(chunks, [None]):
+        final = chunk is None
+        buffer = buffer[position:] + (chunk or '')
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if not opened:
+                if buffer[position] != '[':
+                    raise ValueError('Expected a JSON array')
+                opened = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                break
+            if end == len(buffer) and not final:
+                break
+            if end < len(buffer) and buffer[end] not in JSON_VALUE_DELIMITERS:
+                if final:
+                    raise json.JSONDecodeError('Expecting \',\' delimiter', buffer, end)
+                break
+            yield item
+            position = end
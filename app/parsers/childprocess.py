@@ -4,23 +4,28 @@ from app.objects.secondclass.c_fact import Fact
 from app.objects.secondclass.c_relationship import Relationship
 from app.utility.base_parser import BaseParser
 
+CHILD_ID_PATTERN = re.compile(r'\bProcessId: (.*)', re.IGNORECASE)
+
 
 class Parser(BaseParser):
 
     def parse(self, blob):
         relationships = []
         all_facts = self.used_facts
+        # the most recently added value of each trait, kept up to date as targets are added
+        latest_values = {f.trait: f.value for f in all_facts}
+        matches = self.parse_childid(blob)
         for mp in self.mappers:
-            matches = self.parse_childid(blob)
             for match in matches:
-                src_fact_value = [f.value for f in all_facts if f.trait == mp.source].pop()
+                src_fact_value = latest_values[mp.source]
                 r = Relationship(source=Fact(mp.source, src_fact_value),
                                  edge=mp.edge,
-                                 target=Fact(mp.target, match.strip()))
+                                 target=Fact(mp.target, match))
                 relationships.append(r)
                 all_facts.append(r.target)
+                latest_values[r.target.trait] = r.target.value
         return relationships
 
     @staticmethod
     def parse_childid(blob):
-        return re.findall(r'\bProcessId: (.*)', blob, re.IGNORECASE)
+        return [match.strip() for match in CHILD_ID_PATTERN.findall(blob)]
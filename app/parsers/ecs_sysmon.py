@@ -1,9 +1,13 @@
 import json
 import logging
+from functools import lru_cache
 
 from app.objects.secondclass.c_fact import Fact
 from app.objects.secondclass.c_relationship import Relationship
 from app.utility.base_parser import BaseParser
+from app.utility.base_world import BaseWorld
+
+TRAIT_SPECIAL_CHARS = str.maketrans('', '', '@"[]\\/')
 
 
 class Parser(BaseParser):
@@ -11,6 +15,9 @@ class Parser(BaseParser):
     This parser extracts information from sysmon events that
      have been transformed via the Elastic Common Schema (ECS)
     JSON documents (REF: https://www.elastic.co/guide/en/ecs/current/ecs-field-reference.html).
+    Every field of an event becomes a has_property fact unless limited by the response config: ecs_property_fields
+    lists the fields (and the fields nested under them) to keep, and ecs_property_max_depth stops flattening at that
+    many levels, keeping anything deeper as a JSON value.
     """
 
     logger = logging.getLogger("ecs_parser")
@@ -57,7 +64,9 @@ class Parser(BaseParser):
     def parse_elasticsearch_results(cls, event):
         elasticsearch_id = event['_id']
         relationships = []
-        for k, v in cls.flatten_dict(event["_source"]).items():
+        fields = tuple(BaseWorld.get_config(prop='ecs_property_fields', name='response') or ())
+        max_depth = BaseWorld.get_config(prop='ecs_property_max_depth', name='response')
+        for k, v in cls.flatten_dict(event["_source"], max_depth=max_depth, fields=fields).items():
             try:
                 relationships.append(
                     Relationship(
@@ -108,22 +117,27 @@ class Parser(BaseParser):
         return event['_source']['process']['name']
 
     @staticmethod
-    def flatten_dict(dict_obj):
+    def flatten_dict(dict_obj, max_depth=None, fields=(), sep="."):
+        """
+        Flattens nested dicts into a single dict keyed by the dot-separated path to each value, in document order.
+        Dicts nested max_depth levels down are kept whole, and when fields are given, only the paths equal to or nested
+        under one of them are kept.
+        """
         new = {}
-
-        def _flatten(obj, parent="", sep="."):
-            if isinstance(obj, dict):
-                for k, v in obj.items():
-                    next_parent = parent + sep + str(k) if parent else k
-                    _flatten(v, parent=next_parent)
-            else:
+        stack = [("", dict_obj, 0)]
+        while stack:
+            parent, obj, depth = stack.pop()
+            if isinstance(obj, dict) and not (max_depth and depth >= max_depth):
+                if fields and parent and not any(f == parent or f.startswith(parent + sep) or
+                                                 parent.startswith(f + sep) for f in fields):
+                    continue
+                stack.extend((parent + sep + str(k) if parent else k, v, depth + 1)
+                             for k, v in reversed(list(obj.items())))
+            elif not fields or any(parent == f or parent.startswith(f + sep) for f in fields):
                 new[parent] = obj
-        _flatten(dict_obj)
         return new
 
     @staticmethod
+    @lru_cache(maxsize=4096)
     def _sanitize_fact_traits(trait):
-        special_chars = ('@', '"', '"', '[', ']', '\\', '/')
-        for c in special_chars:
-            trait = trait.replace(c, '')
-        return trait
+        return trait.translate(TRAIT_SPECIAL_CHARS)
@@ -4,44 +4,53 @@ from app.objects.secondclass.c_fact import Fact
 from app.objects.secondclass.c_relationship import Relationship
 from app.utility.base_parser import BaseParser
 
+FIELD_PATTERN = re.compile(r'\b(?P<field>(?:Parent)?Process(?:Id|Guid)):(?P<value>.*)', re.IGNORECASE)
+GUID_PATTERN = re.compile(r'\W+{(.*)}')
+
 
 class Parser(BaseParser):
 
     def parse(self, blob):
         relationships = []
         all_facts = self.used_facts
+        # the most recently added value of each trait, kept up to date as targets are added
+        latest_values = {f.trait: f.value for f in all_facts}
+        fields = self.parse_fields(blob)
         for mp in self.mappers:
-            matches = self.parse_options[mp.target.split('.').pop()](blob)
+            matches = fields[mp.target.split('.').pop()]
             for match in matches:
-                src_fact_value = [f.value for f in all_facts if f.trait == mp.source].pop()
+                src_fact_value = latest_values[mp.source]
                 r = Relationship(source=Fact(mp.source, src_fact_value),
                                  edge=mp.edge,
                                  target=Fact(mp.target, match))
                 relationships.append(r)
                 all_facts.append(r.target)
+                latest_values[r.target.trait] = r.target.value
         return relationships
 
-    @property
-    def parse_options(self):
-        return dict(
-            id=self.parse_id,
-            guid=self.parse_guid,
-            parentid=self.parse_parentid,
-            parentguid=self.parse_parentguid
-        )
-
-    @staticmethod
-    def parse_id(blob):
-        return re.findall(r'\bProcessId: (.*)', blob, re.IGNORECASE)
-
-    @staticmethod
-    def parse_guid(blob):
-        return re.findall(r'\bProcessGuid:\W+{(.*)}', blob, re.IGNORECASE)
-
-    @staticmethod
-    def parse_parentid(blob):
-        return re.findall(r'\bParentProcessId: (.*)', blob, re.IGNORECASE)
-
     @staticmethod
-    def parse_parentguid(blob):
-        return re.findall(r'\bParentProcessGuid:\W+{(.*)}', blob, re.IGNORECASE)
+    def parse_fields(blob):
+        """
+        Extracts every ProcessId, ProcessGuid, ParentProcessId and ParentProcessGuid value in a single pass over the
+        blob, keyed by the last part of the trait they map to and in the order they appear.
+        """
+        fields = dict(id=[], guid=[], parentid=[], parentguid=[])
+        for field, value in iter_process_fields(blob):
+            fields[field].append(value)
+        return fields
+
+
+def iter_process_fields(text):
+    """
+    Yields each ProcessId, ProcessGuid, ParentProcessId and ParentProcessGuid value in the text, in the order they
+    appear, as a pair of the last part of the trait it maps to (id, guid, parentid or parentguid) and the value.
+    """
+    for match in FIELD_PATTERN.finditer(text):
+        field = match.group('field').lower().replace('process', '')
+        value = match.group('value')
+        if field.endswith('guid'):
+            guid = GUID_PATTERN.match(value)
+            if guid:
+                yield field, guid.group(1).strip()
+        elif value.startswith(' '):
+            yield field, value.strip()
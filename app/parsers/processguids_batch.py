@@ -0,0 +1,60 @@
+import re
+
+from app.objects.secondclass.c_fact import Fact
+from app.objects.secondclass.c_relationship import Relationship
+from app.utility.base_parser import BaseParser
+from plugins.response.app.parsers.processguids import iter_process_fields
+
+EVENT_SEPARATOR_PATTERN = re.compile(r'(?:\r?\n){2,}|^(?=Event\[\d+\]:)', re.MULTILINE)
+
+
+class Parser(BaseParser):
+    """
+    Parses process creation events returned by the batched child process ability.
+    The ability is given its parent GUIDs as a comma-separated list (host.process.guids), or as an event log XPath
+    clause (host.process.guids.xpath), and returns the events of all of their children, so each relationship is
+    sourced from the parent GUID found in the event itself.
+    Events missing the child's PID or GUID are discarded. When the list was used, events whose parent is not one of
+    the requested GUIDs are discarded too.
+    """
+
+    def parse(self, blob):
+        relationships = []
+        requested_guids = self._requested_guids()
+        for event in self.split_events(blob):
+            record = self.parse_record(event)
+            parent_guid = record.get('parentguid')
+            if not parent_guid or (requested_guids and parent_guid.lower() not in requested_guids):
+                continue
+            if not record.get('id') or not record.get('guid'):
+                # child PIDs and GUIDs are paired up by position, so an event missing either would misalign the rest
+                continue
+            for mp in self.mappers:
+                match = record.get(mp.target.split('.').pop())
+                if match:
+                    relationships.append(Relationship(source=Fact(mp.source, parent_guid),
+                                                      edge=mp.edge,
+                                                      target=Fact(mp.target, match)))
+        return relationships
+
+    def _requested_guids(self):
+        guids = set()
+        for fact in self.used_facts:
+            if fact.trait == 'host.process.guids':
+                guids.update(g.strip().strip('{}').lower() for g in fact.value.split(',') if g.strip())
+        return guids
+
+    @staticmethod
+    def split_events(blob):
+        return [event for event in EVENT_SEPARATOR_PATTERN.split(blob) if event.strip()]
+
+    @staticmethod
+    def parse_record(event):
+        """
+        Extracts the first ProcessId, ProcessGuid, ParentProcessId and ParentProcessGuid value of an event, keyed by
+        the last part of the trait they map to.
+        """
+        record = dict()
+        for field, value in iter_process_fields(event):
+            record.setdefault(field, value)
+        return record
@@ -4,6 +4,9 @@ from app.objects.secondclass.c_fact import Fact
 from app.objects.secondclass.c_relationship import Relationship
 from app.utility.base_parser import BaseParser
 
+FIELD_PATTERN = re.compile(r'(?:\b(?P<eventid>Id)\s*|(?P<recordid>RecordId)\s*|(?P<user>User)): (?P<value>.*)',
+                           re.IGNORECASE)
+
 
 class Parser(BaseParser):
 
@@ -11,31 +14,24 @@ class Parser(BaseParser):
         relationships = []
         events = [event for event in blob.split('\r\n\r\n') if event != '']
         for event in events:
+            record = self.parse_record(event)
             for mp in self.mappers:
-                match = self.parse_options[mp.target.split('.').pop()](event)
-                if match:
+                match = record.get(mp.target.split('.').pop())
+                if match is not None:
                     guid = [f.value for f in self.used_facts if f.trait == mp.source].pop()
                     relationships.append(Relationship(source=Fact(mp.source, guid),
                                                       edge=mp.edge,
-                                                      target=Fact(mp.target, match.group(1))))
+                                                      target=Fact(mp.target, match)))
         return relationships
 
-    @property
-    def parse_options(self):
-        return dict(
-            eventid=self.parse_eventid,
-            recordid=self.parse_recordid,
-            user=self.parse_user
-        )
-
-    @staticmethod
-    def parse_eventid(event):
-        return re.search(r'\bId\s*: (.*)', event, re.IGNORECASE)
-
-    @staticmethod
-    def parse_recordid(event):
-        return re.search(r'RecordId\s*: (.*)', event, re.IGNORECASE)
-
     @staticmethod
-    def parse_user(event):
-        return re.search(r'User: (.*)', event, re.IGNORECASE)
+    def parse_record(event):
+        """
+        Extracts the first Id, RecordId and User value of an event in a single pass, keyed by the last part of the
+        trait they map to.
+        """
+        record = dict()
+        for match in FIELD_PATTERN.finditer(event):
+            field = next(f for f in ('eventid', 'recordid', 'user') if match.group(f))
+            record.setdefault(field, match.group('value'))
+        return record
@@ -1,5 +1,15 @@
+import time
+import weakref
+
+from plugins.response.app.c_relationshipindex import RelationshipIndex
+
+RESULT_PARSE_GRACE_SECS = 60
+
+
 class BaseRequirement:
 
+    _relationship_indexes = weakref.WeakKeyDictionary()
+
     def __init__(self, requirement_info):
         self.enforcements = requirement_info['enforcements']
 
@@ -19,11 +29,52 @@ class BaseRequirement:
             return False
         return True
 
+    @classmethod
+    def link_completed(cls, operation, link):
+        """
+        Marks the operation's relationship index as stale. A link's result is parsed after the link completes, so its
+        relationships are watched for a while and the index is rebuilt whenever their number changes.
+        """
+        cached = cls._relationship_indexes.setdefault(operation, dict(signature=None, relationships=None,
+                                                                      watched=dict()))
+        cached['watched'][link.id] = (link, None, time.time())
+
     """ PRIVATE """
 
+    @classmethod
+    async def _get_relationship_index(cls, operation):
+        """
+        Returns the operation's relationships indexed by source, only rebuilding the index once links have been added
+        or have completed since it was last built. Cached indexes are dropped along with their operation.
+        """
+        signature = (len(operation.chain), len(operation.source.relationships) if operation.source else 0)
+        cached = cls._relationship_indexes.get(operation)
+        if cached and cached['signature'] == signature and not cls._watched_links_changed(cached['watched']):
+            return cached['relationships']
+        watched = cached['watched'] if cached else dict()
+        relationships = RelationshipIndex(await operation.all_relationships())
+        cls._relationship_indexes[operation] = dict(
+            signature=signature,
+            relationships=relationships,
+            watched={link_id: (link, len(link.relationships), completed)
+                     for link_id, (link, _, completed) in watched.items()}
+        )
+        return relationships
+
+    @staticmethod
+    def _watched_links_changed(watched):
+        now = time.time()
+        for link_id, (link, count, completed) in list(watched.items()):
+            if count is None or len(link.relationships) != count:
+                return True
+            if now - completed > RESULT_PARSE_GRACE_SECS:
+                del watched[link_id]
+        return False
+
     @staticmethod
-    def _get_relationships(uf, relationships):
-        return [r for r in relationships if r.source.trait == uf.trait and r.source.value == uf.value]
+    def _get_relationships(uf, relationships, edge=None):
+        return [r for r in relationships.find(uf.value, edge=edge)
+                if r.source.trait == uf.trait and r.source.value == uf.value]
 
     @staticmethod
     def _check_target(target, match):
@@ -11,10 +11,10 @@ class Requirement(BaseRequirement):
         :param operation
         :return: True if it complies, False if it doesn't
         """
-        relationships = await operation.all_relationships()
+        relationships = await self._get_relationship_index(operation)
         for uf in link.used:
             if self.enforcements['source'] == uf.trait:
-                for r in self._get_relationships(uf, relationships):
+                for r in self._get_relationships(uf, relationships, edge=self.enforcements['edge']):
                     if self.is_valid_relationship([f for f in link.used if f != uf], r):
                         return True
         return False
@@ -10,10 +10,10 @@ class Requirement(BaseRequirement):
         :param operation
         :return: True if it complies, False if it doesn't
         """
-        relationships = await operation.all_relationships()
+        relationships = await self._get_relationship_index(operation)
         for uf in link.used:
             if self.enforcements['source'] == uf.trait:
-                for r in self._get_relationships(uf, relationships):
-                    if r.edge == 'has_property' and r.target.trait == self.enforcements['target']:
+                for r in self._get_relationships(uf, relationships, edge='has_property'):
+                    if r.target.trait == self.enforcements['target']:
                         return True
         return False
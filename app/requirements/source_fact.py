@@ -1,8 +1,12 @@
+import weakref
+
 from plugins.response.app.requirements.base_requirement import BaseRequirement
 
 
 class Requirement(BaseRequirement):
 
+    _source_facts = weakref.WeakKeyDictionary()
+
     async def enforce(self, link, operation):
         """
         Given a link and the current operation, check if the link's used fact is from the operation's fact source.
@@ -10,9 +14,17 @@ class Requirement(BaseRequirement):
         :param operation
         :return: True if it complies, False if it doesn't
         """
+        source_facts = self._get_source_facts(operation)
         for uf in link.used:
-            if self.enforcements['source'] == uf.trait:
-                if any(uf.trait == source_fact.trait and uf.value == source_fact.value for
-                       source_fact in operation.source.facts):
-                    return True
+            if self.enforcements['source'] == uf.trait and (uf.trait, uf.value) in source_facts:
+                return True
         return False
+
+    @classmethod
+    def _get_source_facts(cls, operation):
+        cached = cls._source_facts.get(operation)
+        if cached and cached[0] == len(operation.source.facts):
+            return cached[1]
+        source_facts = {(f.trait, f.value) for f in operation.source.facts}
+        cls._source_facts[operation] = (len(operation.source.facts), source_facts)
+        return source_facts
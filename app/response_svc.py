@@ -1,26 +1,36 @@
 import asyncio
+import gzip
 import json
+import os
+import re
+import threading
+import time
 import uuid
 import yaml
 
 from aiohttp import web
 from aiohttp_jinja2 import template
-from copy import deepcopy
+from copy import copy, deepcopy
 
 from app.objects.secondclass.c_fact import Fact
 from app.objects.c_operation import Operation
 from app.objects.c_source import Source
 from app.objects.secondclass.c_result import Result
 from app.utility.base_service import BaseService
+from plugins.response.app.c_processnode import ProcessNodeSchema
 from plugins.response.app.c_processtree import ProcessTree
+from plugins.response.app.c_relationshipindex import RelationshipIndex
+from plugins.response.app.json_stream import iter_decoded_chunks, iter_json_array
+from plugins.response.app.requirements.base_requirement import BaseRequirement
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+PROCESSTREE_PRUNE_TARGET = 0.9
 
-async def process_elasticsearch_result(data, services):
-    operation = await services.get('app_svc').find_op_with_link(data['link_id'])
-    if hasattr(operation, 'chain'):
-        link = next(filter(lambda l: l.id == data['link_id'], operation.chain))
-        if link.executor.name == 'elasticsearch':
-            await services.get('response_svc').process_elasticsearch_results(operation, link)
+
+async def process_elasticsearch_result(operation, link, services):
+    if link.executor.name == 'elasticsearch':
+        await services.get('response_svc').process_elasticsearch_results(operation, link)
 
 
 async def handle_link_completed(socket, path, services):
@@ -28,7 +38,16 @@ async def handle_link_completed(socket, path, services):
     paw = data['agent']['paw']
     data_svc = services.get('data_svc')
 
-    await process_elasticsearch_result(data, services)
+    services.get('response_svc').notify_link_completed(data['link_id'])
+    operation = await services.get('app_svc').find_op_with_link(data['link_id'])
+    link = next(filter(lambda l: l.id == data['link_id'], operation.chain), None) \
+        if hasattr(operation, 'chain') else None
+    if link:
+        BaseRequirement.link_completed(operation, link)
+    if not BaseService.get_config(prop='auto_operation_enable', name='response'):
+        return
+    if link:
+        await process_elasticsearch_result(operation, link, services)
 
     agent = await data_svc.locate('agents', match=dict(paw=paw, access=data_svc.Access.RED))
     if agent:
@@ -39,17 +58,28 @@ async def handle_link_completed(socket, path, services):
 
 class ResponseService(BaseService):
 
+    re_variable = re.compile(r'#{(.*?)}', flags=re.DOTALL)
+
     def __init__(self, services):
         self.log = self.add_service('response_svc', self)
         self.data_svc = services.get('data_svc')
         self.rest_svc = services.get('rest_svc')
         self.agents = []
+        self.agents_by_host = dict()
+        self.agents_refreshed_at = None
         self.adversary = None
         self.child_process_ability_id = None
         self.collect_guid_ability_id = None
         self.abilities = []
+        self.atomic_ordering = None
+        self.ability_dependencies = dict()
         self.search_time_range = 600000
         self.ops = dict()
+        self.link_completion_events = dict()
+        self.processtrees = dict()
+        self.processtrees_pruned_at = dict()
+        self.processtrees_pruned_sizes = dict()
+        self.processtree_archive_lock = threading.Lock()
 
     @template('response.html')
     async def splash(self, request):
@@ -59,7 +89,7 @@ class ResponseService(BaseService):
     async def update_responder(self, request):
         data = dict(await request.json())
         self.set_config(name='response', prop='adversary', value=data['adversary_id'])
-        await self.apply_adversary_config()
+        await self.apply_adversary_config(force=True)
         await self._save_configurations()
         return web.json_response('complete')
 
@@ -78,6 +108,35 @@ class ResponseService(BaseService):
             res.append(dict(ability_id=ability.ability_id, name=ability.name))
         return web.json_response(res)
 
+    async def response_processtrees(self, request):
+        processtrees = [dict(host=p.host, processes=len(p.guid_to_processnode_map))
+                        for p in await self.data_svc.locate('processtrees')]
+        return web.json_response(self._paginate(request, processtrees))
+
+    async def response_subtree(self, request):
+        processtree = await self._get_processtree(request)
+        guids = await processtree.find_subtree(request.match_info['guid'])
+        return web.json_response(self._paginate(request, guids, lambda g: self._processnode_dict(processtree, g)))
+
+    async def response_ancestry(self, request):
+        processtree = await self._get_processtree(request)
+        guids = await processtree.find_ancestry(request.match_info['guid'])
+        return web.json_response(self._paginate(request, guids, lambda g: self._processnode_dict(processtree, g)))
+
+    async def response_descendants(self, request):
+        processtree = await self._get_processtree(request)
+        guid = request.match_info['guid']
+        return web.json_response(dict(guid=guid, descendants=await processtree.count_descendants(guid)))
+
+    async def response_link_processes(self, request):
+        processtree = await self._get_processtree(request)
+        guids = await processtree.find_guids_by_link(request.match_info['link_id'])
+        return web.json_response(self._paginate(request, guids, lambda g: self._processnode_dict(processtree, g)))
+
+    async def response_restore_processtree(self, request):
+        restored = await self.restore_processtree(request.match_info['host'])
+        return web.json_response(dict(host=request.match_info['host'], restored=len(restored)))
+
     @staticmethod
     async def register_handler(event_svc):
         await event_svc.observe_event(handle_link_completed, exchange='link', queue='completed')
@@ -94,38 +153,77 @@ class ResponseService(BaseService):
         total_facts = []
         total_links = []
 
-        for blue_agent in available_agents:
-            agent_facts, agent_links = await self.run_abilities_on_agent(blue_agent, str(red_agent.pid), pid, op_type)
+        limit = self.get_config(prop='max_concurrent_agents', name='response') or len(available_agents)
+        semaphore = asyncio.Semaphore(limit)
+        results = await asyncio.gather(
+            *[self._run_abilities_on_agent_limited(semaphore, blue_agent, str(red_agent.pid), pid, op_type)
+              for blue_agent in available_agents],
+            return_exceptions=True
+        )
+        for blue_agent, result in zip(available_agents, results):
+            if isinstance(result, Exception):
+                self.log.error('Response on blue agent %s failed: %s' % (blue_agent.paw, result))
+                continue
+            agent_facts, agent_links = result
             total_facts.extend(agent_facts)
             total_links.extend(agent_links)
 
     async def process_elasticsearch_results(self, operation, link):
         file_svc = self.get_service('file_svc')
+        batch_size = self.get_config(prop='elasticsearch_result_batch_size', name='response') or 100
+        encoded_output = file_svc.read_result_file(link.id)
+
+        batch = []
+        for result in iter_json_array(iter_decoded_chunks(encoded_output)):
+            batch.append(result)
+            if len(batch) >= batch_size:
+                await self._add_elasticsearch_results(operation, link, batch)
+                batch = []
+        if batch:
+            await self._add_elasticsearch_results(operation, link, batch)
+
+    async def _add_elasticsearch_results(self, operation, link, results):
         contact_svc = self.get_service('contact_svc')
-        link_output = BaseService.decode_bytes(file_svc.read_result_file(link.id))
-        loaded_output = json.loads(link_output)
-        for result in loaded_output:
-
-            # Add link
-            new_link = deepcopy(link)
-            new_link.facts = []
-            new_link.relationships = []
-            new_link.apply_id(new_link.host)
-            operation.chain.append(new_link)
-            await self.data_svc.store(operation)
-
-            # Add result for new link
-            new_result = Result(
+        new_links = []
+        new_results = []
+        for result in results:
+            new_link = self._copy_link(link)
+            new_links.append(new_link)
+            new_results.append(Result(
                 id=new_link.id,
-                output=BaseService.encode_string(json.dumps(result, indent=4)),
+                output=BaseService.encode_string(json.dumps(result)),
                 pid=str(link.pid),
                 status=str(link.status)
-            )
-            await contact_svc._save(new_result)
+            ))
+
+        operation.chain.extend(new_links)
+        await self.data_svc.store(operation)
+
+        limit = self.get_config(prop='max_concurrent_result_saves', name='response') or len(new_results)
+        semaphore = asyncio.Semaphore(limit)
+
+        async def save_result(result):
+            async with semaphore:
+                await contact_svc._save(result)
+        await asyncio.gather(*[save_result(r) for r in new_results])
+
+    @staticmethod
+    def _copy_link(link):
+        """
+        Creates a pseudo-link for a single Elasticsearch hit. Only the state that differs per pseudo-link is copied;
+        the ability, executor and other read-only state is shared with the original link.
+        """
+        new_link = copy(link)
+        new_link.facts = []
+        new_link.relationships = []
+        new_link.used = list(link.used)
+        new_link.visibility = deepcopy(link.visibility)
+        new_link.apply_id(new_link.host)
+        return new_link
 
     async def get_available_agents(self, agent_to_match):
         await self.refresh_blue_agents_abilities()
-        available_agents = [a for a in self.agents if a.host == agent_to_match.host]
+        available_agents = self.agents_by_host.get(agent_to_match.host, [])
 
         if not available_agents:
             self.log.debug('No available blue agents to respond to red action')
@@ -133,87 +231,245 @@ class ResponseService(BaseService):
 
         return available_agents
 
-    async def refresh_blue_agents_abilities(self):
-        self.agents = await self.data_svc.locate('agents', match=dict(access=self.Access.BLUE))
+    async def refresh_blue_agents_abilities(self, force=False):
+        """
+        Refreshes the host-keyed index of BLUE agents once it is older than agent_index_ttl_secs (or when forced),
+        and re-derives the ability chain only when the responder adversary's ordering has changed.
+        """
+        ttl = self.get_config(prop='agent_index_ttl_secs', name='response') or 0
+        if force or self.agents_refreshed_at is None or time.monotonic() - self.agents_refreshed_at >= ttl:
+            self.agents = await self.data_svc.locate('agents', match=dict(access=self.Access.BLUE))
+            self.agents_by_host = dict()
+            for agent in self.agents:
+                self.agents_by_host.setdefault(agent.host, []).append(agent)
+            self.agents_refreshed_at = time.monotonic()
         await self.apply_adversary_config()
-        self.abilities = []
-        for a in self.adversary.atomic_ordering:
-            if a not in self.abilities:
-                self.abilities.append(a)
+        if self.adversary.atomic_ordering != self.atomic_ordering:
+            self.atomic_ordering = list(self.adversary.atomic_ordering)
+            self.abilities = list(dict.fromkeys(self.atomic_ordering))
+            self.ability_dependencies = await self._get_ability_dependencies(self.abilities)
 
     async def run_abilities_on_agent(self, blue_agent, red_agent_pid, original_pid, op_type):
-        facts = [Fact(trait='host.process.id', value=original_pid),
-                 Fact(trait='sysmon.time.range', value=self.search_time_range)]
+        """
+        Runs the responder's abilities on the blue agent, starting each ability as soon as the abilities producing
+        the facts it requires have completed.
+        """
+        facts = self._initial_facts(original_pid)
         links = []
-        relationships = []
-        for ability_id in self.abilities:
-            if ability_id == self.child_process_ability_id:
-                depth = self.get_config(prop='child_process_recursion_depth', name='response')
-                if not depth:
-                    depth = 5
-                ability_facts, ability_links, ability_relationships = \
-                    await self.find_child_processes(blue_agent, ability_id, original_pid, relationships, op_type, depth)
-            else:
-                ability_facts, ability_links, ability_relationships = \
-                    await self.run_ability_on_agent(blue_agent, red_agent_pid, ability_id, facts, original_pid,
-                                                    relationships, op_type)
-                if ability_id == self.collect_guid_ability_id:
-                    for link in ability_links:
-                        await self.add_link_to_process_tree(link, top_level=True)
-            links.extend(ability_links)
-            facts.extend(ability_facts)
-            relationships.extend(ability_relationships)
+        relationships = RelationshipIndex()
+        dependencies = self.ability_dependencies
+        pending = list(self.abilities)
+        done = set()
+        running = dict()
+        try:
+            while pending or running:
+                for ability_id in [a for a in pending if dependencies.get(a, set()) <= done]:
+                    pending.remove(ability_id)
+                    task = asyncio.ensure_future(
+                        self._run_ability_in_chain(blue_agent, red_agent_pid, ability_id, list(facts), original_pid,
+                                                   relationships, op_type)
+                    )
+                    running[task] = ability_id
+                finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    done.add(running.pop(task))
+                    ability_facts, ability_links, ability_relationships = task.result()
+                    links.extend(ability_links)
+                    facts.extend(ability_facts)
+                    relationships.extend(ability_relationships)
+        finally:
+            for task in running:
+                task.cancel()
         return facts, links
 
+    async def _run_ability_in_chain(self, blue_agent, red_agent_pid, ability_id, facts, original_pid, relationships,
+                                    op_type):
+        if ability_id == self.child_process_ability_id:
+            depth = self.get_config(prop='child_process_recursion_depth', name='response')
+            if not depth:
+                depth = 5
+            return await self.find_child_processes(blue_agent, ability_id, original_pid, relationships, op_type, depth)
+        ability_facts, ability_links, ability_relationships = \
+            await self.run_ability_on_agent(blue_agent, red_agent_pid, ability_id, facts, original_pid,
+                                            relationships, op_type)
+        if ability_id == self.collect_guid_ability_id:
+            for link in ability_links:
+                await self.add_link_to_process_tree(link, top_level=True)
+        return ability_facts, ability_links, ability_relationships
+
+    async def _get_ability_dependencies(self, ability_ids):
+        """
+        Maps each ability to the earlier abilities in the chain whose parsers produce a fact it requires.
+        An ability requiring a fact that no earlier ability produces depends on all earlier abilities, which keeps the
+        original sequential ordering wherever the dependency cannot be determined.
+        """
+        initial_traits = {f.trait for f in self._initial_facts(None)}
+        produced = dict()
+        dependencies = dict()
+        for ability_id in ability_ids:
+            required, provided = await self._get_ability_traits(ability_id)
+            ability_dependencies = set()
+            for trait in required - initial_traits:
+                producers = {a for a, traits in produced.items() if trait in traits}
+                if not producers:
+                    ability_dependencies = set(produced)
+                    break
+                ability_dependencies.update(producers)
+            dependencies[ability_id] = ability_dependencies
+            produced[ability_id] = provided
+        return dependencies
+
+    async def _get_ability_traits(self, ability_id):
+        required = set()
+        provided = set()
+        for ability in await self.data_svc.locate('abilities', match=dict(ability_id=ability_id)):
+            for executor in ability.executors:
+                required.update(v.split('[')[0] for v in self.re_variable.findall(executor.command or ''))
+                for parser in executor.parsers:
+                    for parserconfig in parser.parserconfigs:
+                        if parserconfig.target:
+                            provided.add(parserconfig.target)
+        return required, provided
+
+    def _initial_facts(self, original_pid):
+        return [Fact(trait='host.process.id', value=original_pid),
+                Fact(trait='sysmon.time.range', value=self.search_time_range)]
+
+    async def _run_abilities_on_agent_limited(self, semaphore, blue_agent, red_agent_pid, original_pid, op_type):
+        async with semaphore:
+            return await self.run_abilities_on_agent(blue_agent, red_agent_pid, original_pid, op_type)
+
     async def find_child_processes(self, blue_agent, ability_id, original_pid, relationships, op_type, depth=5):
         process_tree_links = []
         ability_facts = []
         ability_relationships = []
-        parent_guids = [await self._get_original_guid(original_pid, relationships)]
-        child_guids = []
+        original_guid = await self._get_original_guid(original_pid, relationships)
+        parent_guids = [original_guid] if original_guid else []
+        batch_ability_id = self.get_config(prop='child_process_batch_ability', name='response')
+        batch_size = self.get_config(prop='child_process_batch_size', name='response') or 50
+        limit = self.get_config(prop='max_concurrent_child_links', name='response')
         count = 1
         while parent_guids and count <= depth:
-            for pguid in parent_guids:
-                facts = [Fact(trait='host.process.guid', value=pguid),
-                         Fact(trait='sysmon.time.range', value=self.search_time_range)]
-                links = await self.rest_svc.task_agent_with_ability(paw=blue_agent.paw, ability_id=ability_id,
-                                                                    obfuscator='plain-text', facts=facts)
-                await self.save_to_operation(links, op_type)
-                await self.wait_for_link_completion(links, blue_agent)
+            if batch_ability_id:
+                level_facts = [self._batch_child_process_facts(parent_guids[i:i + batch_size])
+                               for i in range(0, len(parent_guids), batch_size)]
+                level_ability_id = batch_ability_id
+            else:
+                level_facts = [[Fact(trait='host.process.guid', value=pguid)] for pguid in parent_guids]
+                level_ability_id = ability_id
+            semaphore = asyncio.Semaphore(limit or len(level_facts))
+            level_links = await asyncio.gather(
+                *[self._run_child_process_ability(semaphore, blue_agent, level_ability_id, facts, original_pid, op_type)
+                  for facts in level_facts]
+            )
+            child_guids = []
+            for links in level_links:
                 for link in links:
                     ability_facts.extend(link.facts)
                     ability_relationships.extend(link.relationships)
-                    link.pin = int(original_pid)
                 child_guids.extend(await self.process_child_process_links(links))
                 process_tree_links.extend(links)
             parent_guids = child_guids
-            child_guids = []
             count += 1
         return ability_facts, process_tree_links, ability_relationships
 
+    @staticmethod
+    def _batch_child_process_facts(parent_guids):
+        """
+        The batched child process ability takes its parent GUIDs either as a comma-separated list, or as an event log
+        XPath clause matching any of them, so the cmd executor can filter the events on the endpoint.
+        """
+        xpath = ' or '.join("*/EventData/Data[@Name='ParentProcessGuid']='{%s}'" % guid for guid in parent_guids)
+        return [Fact(trait='host.process.guids', value=','.join(parent_guids)),
+                Fact(trait='host.process.guids.xpath', value=xpath)]
+
+    async def _run_child_process_ability(self, semaphore, blue_agent, ability_id, facts, original_pid, op_type):
+        async with semaphore:
+            facts = facts + [Fact(trait='sysmon.time.range', value=self.search_time_range)]
+            links = await self.rest_svc.task_agent_with_ability(paw=blue_agent.paw, ability_id=ability_id,
+                                                                obfuscator='plain-text', facts=facts)
+            await self.save_to_operation(links, op_type)
+            await self.wait_for_link_completion(links, blue_agent)
+            for link in links:
+                link.pin = int(original_pid)
+            return links
+
     async def process_child_process_links(self, links):
         child_guids = []
         for link in links:
-            for rel in link.relationships:
-                if rel.edge == 'has_childprocess_guid' and rel.target and rel.target.trait == 'host.process.guid':
-                    child_guids.append(rel.target.value)
-                    await self.add_link_to_process_tree(link)
-                    return child_guids
+            for pid, guid, parent_guid in await self.get_info_from_child_process_link(link):
+                child_guids.append(guid)
+                await self.add_processnode_to_process_tree(link, pid, guid, parent_guid)
         return child_guids
 
     async def add_link_to_process_tree(self, link, top_level=False):
         if top_level:
             pid, guid, parent_guid = await self.get_info_from_top_level_process_link(link)
+            await self.add_processnode_to_process_tree(link, pid, guid, parent_guid)
         else:
-            pid, guid, parent_guid = await self.get_info_from_child_process_link(link)
-        processtree = await self.data_svc.locate('processtrees', match=dict(host=link.host))
-        if not processtree:
-            processtree = ProcessTree(link.host)
-            await self.data_svc.store(processtree)
-        else:
+            for pid, guid, parent_guid in await self.get_info_from_child_process_link(link):
+                await self.add_processnode_to_process_tree(link, pid, guid, parent_guid)
+
+    async def add_processnode_to_process_tree(self, link, pid, guid, parent_guid=None):
+        processtree = await self.get_processtree(link.host, create=True)
+        await processtree.add_processnode(guid, pid, link, parent_guid)
+        await self.prune_processtree(processtree)
+
+    async def prune_processtree(self, processtree, force=False):
+        """
+        Applies the configured retention policy to a ProcessTree, archiving whatever it evicts. Unless forced, this runs
+        at most once per prune interval, or as soon as the tree has grown past its node limit. An oversized tree is
+        pruned below the limit, so that it only grows past it again after a number of further additions.
+        """
+        host = processtree.host
+        max_age = self.get_config(prop='processtree_max_age_secs', name='response')
+        max_nodes = self.get_config(prop='processtree_max_nodes', name='response')
+        interval = self.get_config(prop='processtree_prune_interval_secs', name='response') or 0
+        now = time.time()
+        size = len(processtree.guid_to_processnode_map)
+        target = int(max_nodes * PROCESSTREE_PRUNE_TARGET) if max_nodes is not None else None
+        # a tree that could not be pruned below the limit waits for as many additions as a successful prune allows
+        oversized = max_nodes is not None and \
+            size > max(max_nodes, self.processtrees_pruned_sizes.get(host, 0) + max_nodes - target)
+        if not force and not oversized and now - self.processtrees_pruned_at.get(host, 0) < interval:
+            return []
+        self.processtrees_pruned_at[host] = now
+        evicted = await processtree.evict(max_age=max_age, max_nodes=target, now=now)
+        self.processtrees_pruned_sizes[host] = len(processtree.guid_to_processnode_map)
+        if evicted:
+            await asyncio.get_running_loop().run_in_executor(None, self._archive_processnodes, host, evicted)
+            self.log.debug('Archived %s processes from the %s process tree' % (len(evicted), host))
+        return list(evicted)
+
+    async def restore_processtree(self, host):
+        """
+        Reloads every archived ProcessNode of a host back into its ProcessTree and removes the archive.
+        """
+        processnodes = await asyncio.get_running_loop().run_in_executor(None, self._unarchive_processnodes, host)
+        if not processnodes:
+            return []
+        processtree = await self.get_processtree(host, create=True)
+        restored = await processtree.restore(processnodes)
+        self.processtrees_pruned_at[host] = time.time()
+        return restored
+
+    async def get_processtree(self, host, create=False):
+        """
+        Returns the host's ProcessTree from the host-keyed registry, only falling back to data_svc the first time a
+        host is seen.
+        """
+        processtree = self.processtrees.get(host)
+        if processtree:
+            return processtree
+        processtree = await self.data_svc.locate('processtrees', match=dict(host=host))
+        if processtree:
             # we expect only 1 processtree per host
             processtree = processtree[0]
-        await processtree.add_processnode(guid, pid, link, parent_guid)
+        elif create:
+            processtree = await self.data_svc.store(ProcessTree(host))
+        else:
+            return None
+        return self.processtrees.setdefault(host, processtree)
 
     @staticmethod
     async def get_info_from_top_level_process_link(link):
@@ -229,21 +485,25 @@ class ResponseService(BaseService):
 
     @staticmethod
     async def get_info_from_child_process_link(link):
-        parent_guid = None
-        pid = None
-        guid = None
+        """
+        Returns a (pid, guid, parent_guid) tuple for every child process reported by the link.
+        A link may report children of several parents, so child PIDs and GUIDs are paired up per parent GUID in the
+        order in which they were parsed.
+        """
+        child_pids = dict()
+        child_guids = dict()
         for rel in link.relationships:
             if rel.source.trait == 'host.process.guid' and rel.edge == 'has_childprocess_id' and \
                     rel.target and rel.target.trait == 'host.process.id':
-                if not parent_guid:
-                    parent_guid = rel.source.value
-                pid = int(rel.target.value.strip())
+                child_pids.setdefault(rel.source.value, []).append(int(rel.target.value.strip()))
             elif rel.source.trait == 'host.process.guid' and rel.edge == 'has_childprocess_guid' and \
                     rel.target and rel.target.trait == 'host.process.guid':
-                if not parent_guid:
-                    parent_guid = rel.source.value
-                guid = rel.target.value
-        return pid, guid, parent_guid
+                child_guids.setdefault(rel.source.value, []).append(rel.target.value)
+        children = []
+        for parent_guid, guids in child_guids.items():
+            for pid, guid in zip(child_pids.get(parent_guid, []), guids):
+                children.append((pid, guid, parent_guid))
+        return children
 
     async def run_ability_on_agent(self, blue_agent, red_agent_pid, ability_id, agent_facts, original_pid, relationships, op_type):
         links = await self.rest_svc.task_agent_with_ability(paw=blue_agent.paw, ability_id=ability_id,
@@ -253,20 +513,46 @@ class ResponseService(BaseService):
         ability_facts = []
         ability_relationships = []
         for link in links:
+            relationships.extend(link.relationships)
             ability_relationships.extend(link.relationships)
             link.pin = int(original_pid)
             unique_facts = link.facts[1:]
-            ability_facts.extend(self._filter_ability_facts(unique_facts, relationships + ability_relationships,
-                                                            red_agent_pid, original_pid))
+            ability_facts.extend(self._filter_ability_facts(unique_facts, relationships, red_agent_pid, original_pid))
         return ability_facts, links, ability_relationships
 
-    @staticmethod
-    async def wait_for_link_completion(links, agent):
-        for link in links:
+    async def wait_for_link_completion(self, links, agent):
+        poll_interval = self.get_config(prop='link_completion_poll_secs', name='response') or 3
+        timeout = self.get_config(prop='link_completion_timeout_secs', name='response')
+        await asyncio.gather(*[self._wait_for_link(link, agent, poll_interval, timeout) for link in links])
+
+    def notify_link_completed(self, link_id):
+        event = self.link_completion_events.get(link_id)
+        if event:
+            event.set()
+
+    async def _wait_for_link(self, link, agent, poll_interval, timeout):
+        """
+        Waits until the link finishes, waking as soon as its link/completed event is observed.
+        The link state is also re-checked every poll_interval seconds in case the event is missed.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout if timeout else None
+        event = self.link_completion_events.setdefault(link.id, asyncio.Event())
+        try:
             while not link.finish or link.can_ignore():
-                await asyncio.sleep(3)
+                wait = poll_interval if deadline is None else min(poll_interval, deadline - loop.time())
+                try:
+                    await asyncio.wait_for(event.wait(), max(wait, 0))
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
                 if not agent.trusted:
                     break
+                if deadline is not None and loop.time() >= deadline:
+                    self.log.warning('Timed out waiting for link %s to complete' % link.id)
+                    break
+        finally:
+            self.link_completion_events.pop(link.id, None)
 
     @staticmethod
     async def create_fact_source():
@@ -295,13 +581,70 @@ class ResponseService(BaseService):
             link.operation = self.ops[op_type].id
             self.ops[op_type].add_link(link)
 
-    async def apply_adversary_config(self):
+    async def apply_adversary_config(self, force=False):
         blue_adversary = self.get_config(prop='adversary', name='response')
-        self.adversary = (await self.data_svc.locate('adversaries', match=dict(adversary_id=blue_adversary)))[0]
+        if force or not self.adversary or self.adversary.adversary_id != blue_adversary:
+            self.adversary = (await self.data_svc.locate('adversaries', match=dict(adversary_id=blue_adversary)))[0]
+            self.atomic_ordering = None
         self.search_time_range = self.get_config(prop='search_time_range_msecs', name='response')
         self.child_process_ability_id = self.get_config(prop='child_process_ability', name='response')
         self.collect_guid_ability_id = self.get_config(prop='collect_guid_ability', name='response')
 
+    async def _get_processtree(self, request):
+        processtree = await self.get_processtree(request.match_info['host'])
+        if not processtree:
+            raise web.HTTPNotFound(reason='No process tree for host %s' % request.match_info['host'])
+        return processtree
+
+    def _get_archive_path(self, host):
+        archive_dir = self.get_config(prop='processtree_archive_dir', name='response') or \
+            'plugins/response/data/processtrees'
+        return os.path.join(archive_dir, '%s.jsonl.gz' % re.sub(r'[^\w.-]', '_', host))
+
+    def _archive_processnodes(self, host, processnodes):
+        path = self._get_archive_path(host)
+        schema = ProcessNodeSchema()
+        lines = [json.dumps(dict(guid=guid, **schema.dump(processnode)), separators=(',', ':'))
+                 for guid, processnode in processnodes.items()]
+        with self.processtree_archive_lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # each eviction is appended as its own gzip member, which gzip reads back as a single stream
+            with gzip.open(path, 'at') as archive:
+                archive.write('\n'.join(lines) + '\n')
+
+    def _unarchive_processnodes(self, host):
+        """
+        Reads and removes a host's archive, returning the archived ProcessNodes keyed by GUID.
+        """
+        path = self._get_archive_path(host)
+        schema = ProcessNodeSchema()
+        processnodes = dict()
+        with self.processtree_archive_lock:
+            if not os.path.exists(path):
+                return processnodes
+            with gzip.open(path, 'rt') as archive:
+                for line in archive:
+                    data = json.loads(line)
+                    # later lines hold more recent evictions of the same process
+                    processnodes[data.pop('guid')] = schema.load(data)
+            os.remove(path)
+        return processnodes
+
+    @staticmethod
+    def _processnode_dict(processtree, guid):
+        return dict(guid=guid, **ProcessNodeSchema().dump(processtree.guid_to_processnode_map[guid]))
+
+    @staticmethod
+    def _paginate(request, items, serialize=None):
+        try:
+            offset = max(int(request.query.get('offset', 0)), 0)
+            limit = min(max(int(request.query.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            raise web.HTTPBadRequest(reason='offset and limit must be integers')
+        page = items[offset:offset + limit]
+        return dict(total=len(items), offset=offset, limit=limit,
+                    items=[serialize(i) for i in page] if serialize else page)
+
     async def _save_configurations(self):
         with open('plugins/response/conf/response.yml', 'w') as config:
             config.write(yaml.dump(self.get_config(name='response')))
@@ -321,25 +664,20 @@ class ResponseService(BaseService):
 
     @staticmethod
     def _is_child_guid(relationships, red_pid, original_pid, fact):
-        for r in relationships:
-            if r.edge == 'has_parentid' and \
-                    (r.target.value.strip() == red_pid or r.target.value.strip() == original_pid) \
-                    and r.source.value == fact.value:
-                return True
-        return False
+        return any(relationships.strip(r.target.value) in (red_pid, original_pid)
+                   for r in relationships.find(fact.value, edge='has_parentid'))
 
     @staticmethod
     def _is_red_agent_guid(relationships, red_pid, fact):
-        red_guid = [r.target.value for r in relationships if r.source.value.strip() == red_pid].pop()
-        return fact.value == red_guid
+        red_relationships = relationships.find(red_pid)
+        return bool(red_relationships) and fact.value == red_relationships[-1].target.value
 
     @staticmethod
     async def _get_original_guid(original_pid, relationships):
         source_trait = 'host.process.id'
         edge = 'has_guid'
         target_trait = 'host.process.guid'
-        for rel in relationships:
-            if rel.source.trait == source_trait and rel.source.value == original_pid and \
-                    rel.edge and rel.edge == edge and rel.target and rel.target.trait == target_trait:
+        for rel in relationships.find(original_pid, edge=edge):
+            if rel.source.trait == source_trait and rel.target and rel.target.trait == target_trait:
                 return rel.target.value
         return None
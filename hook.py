@@ -16,11 +16,19 @@ async def enable(services):
     app.router.add_route('POST', '/plugin/responder/update', response_svc.update_responder)
     app.router.add_route('GET', '/plugin/responder/adversaries', response_svc.response_adversaries)
     app.router.add_route('GET', '/plugin/responder/abilities', response_svc.response_abilities)
+    app.router.add_route('GET', '/plugin/responder/processtrees', response_svc.response_processtrees)
+    app.router.add_route('GET', '/plugin/responder/processtrees/{host}/subtree/{guid}', response_svc.response_subtree)
+    app.router.add_route('GET', '/plugin/responder/processtrees/{host}/ancestry/{guid}', response_svc.response_ancestry)
+    app.router.add_route('GET', '/plugin/responder/processtrees/{host}/descendants/{guid}',
+                         response_svc.response_descendants)
+    app.router.add_route('GET', '/plugin/responder/processtrees/{host}/links/{link_id}',
+                         response_svc.response_link_processes)
+    app.router.add_route('POST', '/plugin/responder/processtrees/{host}/restore',
+                         response_svc.response_restore_processtree)
 
     _register_agent('1837b43e-4fff-46b2-a604-a602f7540469')  # Elasticat agent
 
-    if BaseWorld.get_config('auto_operation_enable', 'response'):
-        await response_svc.register_handler(services.get('event_svc'))
+    await response_svc.register_handler(services.get('event_svc'))
 
 
 async def expansion(services):
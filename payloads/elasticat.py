@@ -1,37 +1,61 @@
 import argparse
+import asyncio
 import copy
 import datetime
+import gzip
 import json
 import os
 import platform
 import socket
-import time
+import threading
 import traceback
-from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 from base64 import b64encode, b64decode
 from dateutil import parser as date_parser
+from dateutil import tz
 
 import requests
 import requests.auth
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 HEALTH_CHECK_TIMEOUT = 30
 QUERY_TIMEOUT = 60
 BEACON_TIMEOUT = 60
+PIT_KEEP_ALIVE = '1m'
+SCROLL_KEEP_ALIVE = '1m'
+RETRY_STATUS_CODES = (502, 503, 504)
+SOURCE_FIELDS_PREFIX = '_source='
 
 
 class OperationLoop:
 
     def __init__(self, server, es_host='http://127.0.0.1:9200', index_pattern='*',
                  result_size=10, group='blue', minutes_since=60, sleep=15,
-                 user='', password='', start_time=None, end_time='now'):
+                 user='', password='', start_time=None, end_time='now', paginate=False, page_size=1000,
+                 max_results=10000, pool_size=10, max_retries=3, retry_backoff=0.5,
+                 workers=1, msearch=True, full_window=False, checkpoint_file=None, compress=False):
         self.es_host = es_host
         self.index_pattern = index_pattern
         self.result_size = result_size
+        self.paginate = paginate
+        self.page_size = page_size
+        self.max_results = max_results
         self.start_time = start_time
         self.end_time = end_time
         self.minutes_since = minutes_since
         self.sleep = sleep
-        self.instruction_queue = Queue()
+        self.instruction_queue = None
+        self.result_queue = None
+        self.workers = workers
+        self._idle_workers = 0
+        self.msearch = msearch
+        self.full_window = full_window
+        self.checkpoint_file = checkpoint_file
+        self.compress = compress
+        self._checkpoint_lock = threading.Lock()
+        self._high_water_marks = self._load_checkpoints()
+        self._beacon_lock = threading.Lock()
         self._profile = dict(
             server=server,
             host=socket.gethostname(),
@@ -47,6 +71,11 @@ class OperationLoop:
         if self.user or self.password:
             self.auth = requests.auth.HTTPBasicAuth(self.user, self.password)
 
+        self.es_session = self._build_session(pool_size, max_retries, retry_backoff,
+                                              retry_methods=('GET', 'POST', 'DELETE'))
+        # beacons carry results, so one that may have reached the server is never sent again
+        self.server_session = self._build_session(pool_size, max_retries, retry_backoff, retry_methods=())
+
     def get_profile(self):
         return copy.copy(self._profile)
 
@@ -59,23 +88,68 @@ class OperationLoop:
         return self._profile.get('paw', 'unknown')
 
     def test_elastic_connection(self):
-        resp = requests.get('%s/_cat/health' % (self.es_host,), params=dict(format='json'), auth=self.auth, timeout=HEALTH_CHECK_TIMEOUT)
+        resp = self.es_session.get('%s/_cat/health' % (self.es_host,), params=dict(format='json'), auth=self.auth, timeout=HEALTH_CHECK_TIMEOUT)
         resp.raise_for_status()
         print("[*] Connection to Elasticsearch OK. %s" % resp.json())
 
     def execute_lucene_query(self, lucene_query_string):
-        if self.start_time:
-            query_string = ('event.created:[%s TO ' + self.end_time + '] AND %s') % (self.start_time,
-                                                                                     lucene_query_string)
-        else:
-            query_string = 'event.created:[now-%im TO now] AND %s' % (self.minutes_since, lucene_query_string)
-        body = dict(query=dict(query_string=dict(query=query_string)))
-        execution_timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        resp = requests.post('%s/%s/_search' % (self.es_host, self.index_pattern),
-                             params=dict(size=self.result_size),
-                             json=body, auth=self.auth, timeout=QUERY_TIMEOUT)
+        lucene_query_string, source_fields = self._split_source_fields(lucene_query_string)
+        body = self._search_body(self._build_query(lucene_query_string), source_fields=source_fields)
+        execution_timestamp = self._timestamp()
+        resp = self.es_session.post('%s/%s/_search' % (self.es_host, self.index_pattern),
+                                    params=dict(size=self.result_size),
+                                    json=body, auth=self.auth, timeout=QUERY_TIMEOUT)
+        resp.raise_for_status()
+        hits = resp.json().get('hits', {}).get('hits', [])
+        self._advance_high_water_mark(lucene_query_string, hits)
+        return hits, execution_timestamp
+
+    def execute_lucene_queries(self, lucene_query_strings):
+        """
+        Runs several queries in a single _msearch request.
+        Returns a (hits, error) tuple per query, in the order the queries were given, and the execution timestamp.
+        """
+        lines = []
+        lucene_query_strings = [self._split_source_fields(q) for q in lucene_query_strings]
+        for lucene_query_string, source_fields in lucene_query_strings:
+            lines.append(json.dumps(dict(index=self.index_pattern)))
+            lines.append(json.dumps(self._search_body(self._build_query(lucene_query_string),
+                                                      source_fields=source_fields, size=self.result_size)))
+        execution_timestamp = self._timestamp()
+        resp = self.es_session.post('%s/_msearch' % (self.es_host,), data='\n'.join(lines) + '\n',
+                                    headers={'Content-Type': 'application/x-ndjson'}, auth=self.auth,
+                                    timeout=QUERY_TIMEOUT)
         resp.raise_for_status()
-        return resp.json().get('hits', {}).get('hits', []), execution_timestamp
+        responses = [(r.get('hits', {}).get('hits', []), r.get('error')) for r in resp.json().get('responses', [])]
+        for (lucene_query_string, _), (hits, _) in zip(lucene_query_strings, responses):
+            self._advance_high_water_mark(lucene_query_string, hits)
+        return responses, execution_timestamp
+
+    def iter_lucene_query_pages(self, lucene_query_string):
+        """
+        Yields (hits, execution_timestamp) for each page of results matching the query, up to max_results hits.
+        Pages are fetched with search_after over a point in time, falling back to the scroll API when the
+        Elasticsearch cluster does not support points in time.
+        """
+        lucene_query_string, source_fields = self._split_source_fields(lucene_query_string)
+        query = self._build_query(lucene_query_string)
+        try:
+            pit_id = self._open_point_in_time()
+        except requests.HTTPError:
+            pages = self._iter_scroll_pages(query, source_fields)
+        else:
+            pages = self._iter_search_after_pages(query, source_fields, pit_id)
+        remaining = self.max_results
+        try:
+            for hits, execution_timestamp in pages:
+                hits = hits[:remaining]
+                remaining -= len(hits)
+                self._advance_high_water_mark(lucene_query_string, hits)
+                yield hits, execution_timestamp
+                if remaining <= 0:
+                    break
+        finally:
+            pages.close()
 
     def start(self):
         self.test_elastic_connection()
@@ -83,52 +157,364 @@ class OperationLoop:
             print("[*] Querying for events created from %s to %s" % (self.start_time, self.end_time))
         else:
             print("[*] Querying for events created %s minutes before now" % self.minutes_since)
+        asyncio.run(self._operation_loop())
+
+    """ PRIVATE """
+
+    def _build_query(self, lucene_query_string):
+        high_water_mark = self._get_high_water_mark(lucene_query_string)
+        if high_water_mark:
+            end_time = self.end_time if self.start_time else 'now'
+            query_string = 'event.created:["%s" TO %s] AND %s' % (high_water_mark['created'], end_time,
+                                                                  lucene_query_string)
+        elif self.start_time:
+            query_string = ('event.created:[%s TO ' + self.end_time + '] AND %s') % (self.start_time,
+                                                                                     lucene_query_string)
+        else:
+            query_string = 'event.created:[now-%im TO now] AND %s' % (self.minutes_since, lucene_query_string)
+        query = dict(query_string=dict(query=query_string))
+        if high_water_mark and high_water_mark['ids']:
+            # events created at the high water mark itself are only skipped once they have been returned
+            query = dict(bool=dict(must=[query], must_not=[dict(ids=dict(values=high_water_mark['ids']))]))
+        return query
+
+    def _search_body(self, query, sort=None, source_fields=None, **kwargs):
+        """
+        Incremental queries are sorted by creation time, so that a query capped by its result size always returns
+        the oldest unseen events and the high water mark never skips over events that were not returned.
+        """
+        sort = ([] if self.full_window else [{'event.created': 'asc'}]) + (sort or [])
+        body = dict(query=query, **kwargs)
+        if sort:
+            body['sort'] = sort
+        if source_fields:
+            if not self.full_window and 'event.created' not in source_fields:
+                # the high water mark is read from each hit's creation time
+                source_fields = source_fields + ['event.created']
+            body['_source'] = source_fields
+        return body
+
+    @staticmethod
+    def _split_source_fields(command):
+        """
+        A hunting ability can limit the fields returned for each hit by starting its command with
+        "_source=<field>,<field>;", followed by the Lucene query.
+        Returns the Lucene query and the list of fields, or None when all fields should be returned.
+        """
+        command = command.strip()
+        if not command.startswith(SOURCE_FIELDS_PREFIX):
+            return command, None
+        fields, _, lucene_query_string = command[len(SOURCE_FIELDS_PREFIX):].partition(';')
+        return lucene_query_string.strip(), [f.strip() for f in fields.split(',') if f.strip()]
+
+    def _get_high_water_mark(self, lucene_query_string):
+        """
+        Returns the creation time of the newest event already returned for the query, and the ids of the returned
+        events created at that time, when it falls after the start of the configured search window.
+        """
+        if self.full_window:
+            return None
+        with self._checkpoint_lock:
+            high_water_mark = self._high_water_marks.get(lucene_query_string)
+        if not high_water_mark:
+            return None
+        if self.start_time:
+            window_start = self._parse_time(self.start_time)
+        else:
+            window_start = datetime.datetime.now(tz.tzutc()) - datetime.timedelta(minutes=self.minutes_since)
+        return high_water_mark if self._parse_time(high_water_mark['created']) > window_start else None
+
+    def _advance_high_water_mark(self, lucene_query_string, hits):
+        created = [(self._parse_time(c), c, h.get('_id')) for c, h in ((self._event_created(h), h) for h in hits) if c]
+        if self.full_window or not created:
+            return
+        newest_time = max(t for t, _, _ in created)
+        newest = next(c for t, c, _ in created if t == newest_time)
+        newest_ids = [i for t, _, i in created if t == newest_time and i]
+        with self._checkpoint_lock:
+            current = self._high_water_marks.get(lucene_query_string)
+            if current:
+                current_time = self._parse_time(current['created'])
+                if current_time > newest_time:
+                    return
+                if current_time == newest_time:
+                    newest_ids = current['ids'] + [i for i in newest_ids if i not in current['ids']]
+            self._high_water_marks[lucene_query_string] = dict(created=newest, ids=newest_ids)
+            self._save_checkpoints()
+
+    def _load_checkpoints(self):
+        if not self.checkpoint_file or not os.path.exists(self.checkpoint_file):
+            return dict()
+        with open(self.checkpoint_file, 'r') as f:
+            checkpoints = json.load(f)
+        # checkpoints written before ids were kept only hold the creation time
+        return {q: dict(created=m, ids=[]) if isinstance(m, str) else m for q, m in checkpoints.items()}
+
+    def _save_checkpoints(self):
+        if not self.checkpoint_file:
+            return
+        tmp_file = '%s.tmp' % self.checkpoint_file
+        with open(tmp_file, 'w') as f:
+            json.dump(self._high_water_marks, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    @staticmethod
+    def _event_created(hit):
+        source = hit.get('_source', {})
+        return source.get('event', {}).get('created') or source.get('event.created')
+
+    @staticmethod
+    def _parse_time(s):
+        parsed = date_parser.parse(s)
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=tz.tzutc())
+
+    def _open_point_in_time(self):
+        resp = self.es_session.post('%s/%s/_pit' % (self.es_host, self.index_pattern),
+                                    params=dict(keep_alive=PIT_KEEP_ALIVE), auth=self.auth, timeout=QUERY_TIMEOUT)
+        resp.raise_for_status()
+        return resp.json()['id']
+
+    def _iter_search_after_pages(self, query, source_fields, pit_id):
+        search_after = None
+        try:
+            while True:
+                body = self._search_body(query, sort=[dict(_shard_doc='asc')], source_fields=source_fields,
+                                         size=self.page_size, pit=dict(id=pit_id, keep_alive=PIT_KEEP_ALIVE))
+                if search_after:
+                    body['search_after'] = search_after
+                execution_timestamp = self._timestamp()
+                resp = self.es_session.post('%s/_search' % (self.es_host,), json=body, auth=self.auth,
+                                            timeout=QUERY_TIMEOUT)
+                resp.raise_for_status()
+                page = resp.json()
+                pit_id = page.get('pit_id', pit_id)
+                hits = page.get('hits', {}).get('hits', [])
+                if not hits:
+                    return
+                yield hits, execution_timestamp
+                if len(hits) < self.page_size:
+                    return
+                search_after = hits[-1]['sort']
+        finally:
+            try:
+                self.es_session.delete('%s/_pit' % (self.es_host,), json=dict(id=pit_id), auth=self.auth,
+                                       timeout=QUERY_TIMEOUT)
+            except requests.RequestException as e:
+                print('[-] Failed to close point in time: %s' % e)
+
+    def _iter_scroll_pages(self, query, source_fields):
+        execution_timestamp = self._timestamp()
+        resp = self.es_session.post('%s/%s/_search' % (self.es_host, self.index_pattern),
+                                    params=dict(scroll=SCROLL_KEEP_ALIVE, size=self.page_size),
+                                    json=self._search_body(query, source_fields=source_fields), auth=self.auth,
+                                    timeout=QUERY_TIMEOUT)
+        resp.raise_for_status()
+        page = resp.json()
+        scroll_id = page.get('_scroll_id')
+        try:
+            while True:
+                hits = page.get('hits', {}).get('hits', [])
+                if not hits:
+                    return
+                yield hits, execution_timestamp
+                if len(hits) < self.page_size:
+                    return
+                execution_timestamp = self._timestamp()
+                resp = self.es_session.post('%s/_search/scroll' % (self.es_host,),
+                                            json=dict(scroll=SCROLL_KEEP_ALIVE, scroll_id=scroll_id),
+                                            auth=self.auth, timeout=QUERY_TIMEOUT)
+                resp.raise_for_status()
+                page = resp.json()
+                scroll_id = page.get('_scroll_id', scroll_id)
+        finally:
+            if scroll_id:
+                try:
+                    self.es_session.delete('%s/_search/scroll' % (self.es_host,), json=dict(scroll_id=scroll_id),
+                                           auth=self.auth, timeout=QUERY_TIMEOUT)
+                except requests.RequestException as e:
+                    print('[-] Failed to clear scroll: %s' % e)
+
+    async def _operation_loop(self):
+        """
+        Beaconing, query execution and result upload run as independent tasks, so a slow query never delays the
+        heartbeat beacon. Blocking HTTP calls run on a thread pool. Query workers wait for the result queue to drain
+        when uploads fall behind.
+        """
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=self.workers + 2))
+        self.instruction_queue = asyncio.Queue()
+        self.result_queue = asyncio.Queue(maxsize=self.workers * 2)
+        tasks = [self._beacon_task(), self._upload_task()] + [self._query_task() for _ in range(self.workers)]
+        await asyncio.gather(*tasks)
+
+    async def _beacon_task(self):
         while True:
             try:
                 print('[*] Sending beacon for %s' % (self.paw,))
-                self._send_beacon()
-                self._handle_instructions()
-                time.sleep(self.sleep)
+                await self._beacon()
+                await asyncio.sleep(self.sleep)
             except Exception as e:
                 print('[-] Operation loop error: %s' % e)
                 traceback.print_exc()
-                time.sleep(30)
+                await asyncio.sleep(30)
 
-    """ PRIVATE """
+    async def _query_task(self):
+        loop = asyncio.get_running_loop()
+
+        def send_results(results):
+            asyncio.run_coroutine_threadsafe(self.result_queue.put(results), loop).result()
+
+        while True:
+            instructions = await self._next_instructions_batch()
+            try:
+                await loop.run_in_executor(None, self._run_instructions, instructions, send_results)
+            except Exception as e:
+                print('[-] Instruction error: %s' % e)
+                traceback.print_exc()
+            await asyncio.sleep(max(i['sleep'] for i in instructions))
+
+    async def _upload_task(self):
+        while True:
+            results = await self.result_queue.get()
+            while not self.result_queue.empty():
+                results.extend(self.result_queue.get_nowait())
+            while True:
+                try:
+                    await self._beacon(results)
+                    break
+                except requests.ConnectionError as e:
+                    # the connection could not be made (ConnectTimeout is a ConnectionError), so the results were
+                    # never sent and can be sent again
+                    print('[-] Failed to send results: %s' % e)
+                    await asyncio.sleep(30)
+                except Exception as e:
+                    # the server may already have saved the results, and sending them again would ingest them twice
+                    print('[-] Failed to send results, not sending them again: %s' % e)
+                    break
+
+    async def _beacon(self, results=None):
+        beacon_resp = await asyncio.get_running_loop().run_in_executor(None, self._send_beacon, results)
+        self._queue_instructions(beacon_resp)
+
+    def _queue_instructions(self, beacon_resp):
+        """
+        Queues the instructions of a beacon response. Instructions that can not be read are dropped, as the beacon
+        carrying them, and any results sent with it, has already been received by the server.
+        """
+        try:
+            instructions = [json.loads(i) for i in json.loads(beacon_resp.get('instructions', '[]'))]
+        except (TypeError, ValueError) as e:
+            print('[-] Failed to read instructions: %s' % e)
+            return
+        for instruction in instructions:
+            self.instruction_queue.put_nowait(instruction)
+
+    async def _next_instructions_batch(self):
+        """
+        Waits for the next instruction or, when queries can be combined into one _msearch request, takes an even
+        share of the queued instructions, leaving the rest to the other idle workers.
+        """
+        self._idle_workers += 1
+        try:
+            instructions = [await self.instruction_queue.get()]
+        finally:
+            self._idle_workers -= 1
+        if self.msearch and not self.paginate:
+            share = -(-(self.instruction_queue.qsize() + 1) // (self._idle_workers + 1))
+            while len(instructions) < share and not self.instruction_queue.empty():
+                instructions.append(self.instruction_queue.get_nowait())
+        return instructions
 
-    def _handle_instructions(self):
-        while not self.instruction_queue.empty():
-            i = self.instruction_queue.get()
-            result, seconds = self._execute_instruction(json.loads(i))
-            self._send_beacon(results=[result])
-            time.sleep(seconds)
+    def _run_instructions(self, instructions, send_results):
+        if len(instructions) == 1:
+            return self._run_instruction(instructions[0], send_results)
+        print('[+] Running instructions: %s' % ', '.join(i['id'] for i in instructions))
+        queries = [self._decode_bytes(i['command']) for i in instructions]
+        responses, execution_timestamp = self.execute_lucene_queries(queries)
+        results = []
+        for i, (hits, error) in zip(instructions, responses):
+            if error:
+                print('[-] Query for instruction %s failed: %s' % (i['id'], error))
+            results.append(self._build_result(i, hits, execution_timestamp, status=1 if error else 0))
+        send_results(results)
+
+    def _run_instruction(self, i, send_results):
+        if self.paginate:
+            send_results([self._execute_paginated_instruction(i)])
         else:
-            self._send_beacon()
+            result, _ = self._execute_instruction(i)
+            send_results([result])
 
     def _next_instructions(self, beacon):
         return json.loads(self._decode_bytes(beacon['instructions']))
 
-    def _send_beacon(self, results=None, enqueue_instructions=True):
+    def _send_beacon(self, results=None):
+        with self._beacon_lock:
+            return self._send_beacon_locked(results)
+
+    def _send_beacon_locked(self, results):
         results = results or []
         beacon = self.get_profile()
         beacon['results'] = results
         body = self._encode_string(json.dumps(beacon))
-        resp = requests.post('%s/beacon' % (self.server,), data=body, timeout=BEACON_TIMEOUT)
+        headers = None
+        if self.compress:
+            body = gzip.compress(body.encode())
+            headers = {'Content-Encoding': 'gzip'}
+        resp = self.server_session.post('%s/beacon' % (self.server,), data=body, headers=headers,
+                                        timeout=BEACON_TIMEOUT)
         resp.raise_for_status()
         beacon_resp = json.loads(self._decode_bytes(resp.text))
         self._profile['paw'] = beacon_resp['paw']
         self.sleep = beacon_resp['sleep']
-
-        if enqueue_instructions:
-            for instruction in json.loads(beacon_resp.get('instructions', [])):
-                self.instruction_queue.put(instruction)
         return beacon_resp
 
     def _execute_instruction(self, i):
         print('[+] Running instruction: %s' % i['id'])
         query = self._decode_bytes(i['command'])
         results, execution_timestamp = self.execute_lucene_query(query)
-        return dict(output=self._encode_string(json.dumps(results)), pid=os.getpid(), status=0, id=i['id'], agent_reported_time=execution_timestamp), i['sleep']
+        return self._build_result(i, results, execution_timestamp), i['sleep']
+
+    def _execute_paginated_instruction(self, i):
+        """
+        Fetches every page of results and returns them as a single result. The server keeps one result per link and
+        marks the link finished as soon as a result arrives, so pages can not be sent back separately. Each page is
+        serialized as it is fetched, so only the encoded hits are held until the last page.
+        """
+        print('[+] Running paginated instruction: %s' % i['id'])
+        query = self._decode_bytes(i['command'])
+        pages = []
+        execution_timestamp = None
+        for results, page_timestamp in self.iter_lucene_query_pages(query):
+            execution_timestamp = execution_timestamp or page_timestamp
+            if results:
+                pages.append(json.dumps(results)[1:-1])
+        return self._build_serialized_result(i, '[%s]' % ','.join(pages), execution_timestamp or self._timestamp())
+
+    def _build_result(self, i, results, execution_timestamp, status=0):
+        return self._build_serialized_result(i, json.dumps(results), execution_timestamp, status=status)
+
+    def _build_serialized_result(self, i, output, execution_timestamp, status=0):
+        return dict(output=self._encode_string(output), pid=os.getpid(), status=status, id=i['id'],
+                    agent_reported_time=execution_timestamp)
+
+    @staticmethod
+    def _timestamp():
+        return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    @staticmethod
+    def _build_session(pool_size, max_retries, retry_backoff, retry_methods):
+        """
+        Builds a session whose connections are pooled and kept alive across requests, retrying failed connections
+        with exponential backoff. Read errors and gateway errors are only retried for requests using one of
+        retry_methods, as the server may already have handled them.
+        """
+        retry = Retry(total=max_retries, backoff_factor=retry_backoff, status_forcelist=RETRY_STATUS_CODES,
+                      allowed_methods=frozenset(retry_methods), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
     @staticmethod
     def _decode_bytes(s):
@@ -170,6 +556,34 @@ if __name__ == '__main__':
                         help='Number of seconds to wait to check for new commands.')
     parser.add_argument('--result-size', default=10, type=int, dest='result_size',
                         help='The maximum number for results that will be returned per elasticsearch query.')
+    parser.add_argument('--paginate', action='store_true',
+                        help='Return all results matching each query, fetched in pages and sent back together, instead '
+                             'of only the first --result-size results.')
+    parser.add_argument('--page-size', default=1000, type=int, dest='page_size',
+                        help='The number of results fetched per page when --paginate is used.')
+    parser.add_argument('--max-results', default=10000, type=int, dest='max_results',
+                        help='The maximum number of results returned per query when --paginate is used.')
+    parser.add_argument('--pool-size', default=10, type=int, dest='pool_size',
+                        help='The number of connections kept alive to each of Elasticsearch and the Caldera server.')
+    parser.add_argument('--max-retries', default=3, type=int, dest='max_retries',
+                        help='How many times a failed connection or gateway error is retried.')
+    parser.add_argument('--retry-backoff', default=0.5, type=float, dest='retry_backoff',
+                        help='Backoff factor, in seconds, applied between retries.')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='The number of queries run concurrently. Results are sent back as each query completes, '
+                             'independently of the beacon interval.')
+    parser.add_argument('--no-msearch', action='store_false', dest='msearch',
+                        help='Run each queued query in its own _search request instead of combining the queries '
+                             'received in a beacon into one _msearch request.')
+    parser.add_argument('--full-window', action='store_true', dest='full_window',
+                        help='Search the full time window on every query. By default, a query that has run before '
+                             'only returns events it has not returned yet, created no earlier than the newest one it '
+                             'returned.')
+    parser.add_argument('--checkpoint-file', default=None, dest='checkpoint_file',
+                        help='File in which the newest events seen per query are saved, so that incremental queries '
+                             'resume where they left off after a restart.')
+    parser.add_argument('--compress', action='store_true',
+                        help='Gzip the body of beacons sent to the Caldera server.')
     parser.add_argument('--elastic-user', default='', dest='elastic_user',
                         help='User name for use when authenticating to elasticsarch.')
     parser.add_argument('--elastic-password', default='', dest='elastic_password',
@@ -181,7 +595,11 @@ if __name__ == '__main__':
         OperationLoop(args.server, es_host=args.es_host, index_pattern=args.index, group=args.group,
                       minutes_since=args.minutes_since, sleep=args.sleep, result_size=args.result_size,
                       user=args.elastic_user, password=args.elastic_password, start_time=args.start_time,
-                      end_time=args.end_time).start()
+                      end_time=args.end_time, paginate=args.paginate, page_size=args.page_size,
+                      max_results=args.max_results, pool_size=args.pool_size, max_retries=args.max_retries,
+                      retry_backoff=args.retry_backoff, workers=args.workers,
+                      msearch=args.msearch, full_window=args.full_window,
+                      checkpoint_file=args.checkpoint_file, compress=args.compress).start()
     except Exception as e:
         print('[-] Caldera server not be accessible, or: %s' % e)
         raise e
@@ -0,0 +1,53 @@
+import base64
+import importlib.util
+import json
+import os
+
+import pytest
+
+
+PLUGIN_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def _load_json_stream():
+    spec = importlib.util.spec_from_file_location('json_stream', os.path.join(PLUGIN_DIR, 'app', 'json_stream.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+json_stream = _load_json_stream()
+
+
+class TestIterJsonArray:
+    """Tests that JSON arrays are streamed correctly regardless of where chunk boundaries fall."""
+
+    DOCUMENT = '[1, 23, 456, true, null, "s", 15000000000.0, {"_score": 1.25, "_id": "a,]"}, [2.5e3], -7]'
+
+    def test_every_split_point(self):
+        expected = json.loads(self.DOCUMENT)
+        for split in range(len(self.DOCUMENT) + 1):
+            chunks = [self.DOCUMENT[:split], self.DOCUMENT[split:]]
+            assert list(json_stream.iter_json_array(chunks)) == expected, 'split at %s' % split
+
+    @pytest.mark.parametrize('chunk_size', [1, 2, 3, 4, 5, 8, 13])
+    def test_fixed_chunk_sizes(self, chunk_size):
+        chunks = [self.DOCUMENT[i:i + chunk_size] for i in range(0, len(self.DOCUMENT), chunk_size)]
+        assert list(json_stream.iter_json_array(chunks)) == json.loads(self.DOCUMENT)
+
+    @pytest.mark.parametrize('chunk_size', [4, 8, 12])
+    def test_base64_chunks(self, chunk_size):
+        encoded = base64.b64encode(self.DOCUMENT.encode('utf-8')).decode('utf-8')
+        items = json_stream.iter_json_array(json_stream.iter_decoded_chunks(encoded, chunk_size=chunk_size))
+        assert list(items) == json.loads(self.DOCUMENT)
+
+    def test_empty_array(self):
+        assert list(json_stream.iter_json_array(['[', ' ]'])) == []
+
+    def test_invalid_value_raises(self):
+        with pytest.raises(json.JSONDecodeError):
+            list(json_stream.iter_json_array(['[1x]']))
+
+    def test_not_an_array_raises(self):
+        with pytest.raises(ValueError):
+            list(json_stream.iter_json_array(['{"a": 1}']))
@@ -0,0 +1,93 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+c_processtree = pytest.importorskip('plugins.response.app.c_processtree')
+
+
+HOST = 'host'
+
+
+def _link(link_id, host=HOST):
+    return SimpleNamespace(id=link_id, host=host)
+
+
+def _add(tree, guid, pid, parent_guid=None, link_id='link'):
+    asyncio.run(tree.add_processnode(guid, pid, _link(link_id), parent_guid=parent_guid))
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class TestProcessTree:
+    """Tests the ProcessTree indexes, root cache, eviction and restore."""
+
+    def test_root_cache_updated_when_cached_root_is_added(self):
+        tree = c_processtree.ProcessTree(HOST)
+        _add(tree, 'A', 10, parent_guid='P')
+        assert _run(tree.find_original_processes_by_pid(10)) == []
+        _add(tree, 'P', 20, parent_guid='Q')
+        _add(tree, 'Q', 30)
+        assert _run(tree.find_original_processes_by_pid(10)) == [30]
+
+    def test_root_cache_updated_on_reparent(self):
+        tree = c_processtree.ProcessTree(HOST)
+        _add(tree, 'R1', 1)
+        _add(tree, 'R2', 2)
+        _add(tree, 'A', 10, parent_guid='R1')
+        assert _run(tree.find_original_processes_by_pid(10)) == [1]
+        _add(tree, 'A', 10, parent_guid='R2')
+        assert _run(tree.find_original_processes_by_pid(10)) == [2]
+        assert 'A' not in tree.guid_to_processnode_map['R1'].child_guids
+
+    def test_readd_keeps_children_and_parent(self):
+        tree = c_processtree.ProcessTree(HOST)
+        _add(tree, 'R', 1)
+        _add(tree, 'A', 10, parent_guid='R')
+        _add(tree, 'B', 11, parent_guid='A')
+        _add(tree, 'A', 10, link_id='other')
+        assert tree.guid_to_processnode_map['A'].parent_guid == 'R'
+        assert _run(tree.find_subtree('A')) == ['A', 'B']
+        assert _run(tree.find_guids_by_link('other')) == ['A']
+        assert _run(tree.find_guids_by_link('link')) == ['B', 'R']
+
+    def test_evict_by_age_removes_subtrees(self):
+        tree = c_processtree.ProcessTree(HOST)
+        _add(tree, 'R', 1)
+        _add(tree, 'A', 10, parent_guid='R')
+        _add(tree, 'S', 2)
+        for guid, last_seen in (('R', 100), ('A', 100), ('S', 200)):
+            tree.guid_to_processnode_map[guid].last_seen = last_seen
+        evicted = _run(tree.evict(max_age=50, now=210))
+        assert sorted(evicted) == ['A', 'R']
+        assert list(tree.guid_to_processnode_map) == ['S']
+        assert _run(tree.find_original_processes_by_pid(10)) == []
+
+    def test_evict_by_size_keeps_most_recent_path(self):
+        tree = c_processtree.ProcessTree(HOST)
+        _add(tree, 'R', 1)
+        for i, guid in enumerate('ABC'):
+            _add(tree, guid, 10 + i, parent_guid='R')
+        for i, guid in enumerate('ABC'):
+            tree.guid_to_processnode_map[guid].last_seen = 100 + i
+        tree.guid_to_processnode_map['R'].last_seen = 102
+        evicted = _run(tree.evict(max_nodes=2))
+        assert sorted(evicted) == ['A', 'B']
+        assert sorted(tree.guid_to_processnode_map) == ['C', 'R']
+        assert tree.guid_to_processnode_map['R'].child_guids == {'C'}
+
+    def test_restore_reattaches_evicted_processes(self):
+        tree = c_processtree.ProcessTree(HOST)
+        _add(tree, 'R', 1)
+        _add(tree, 'A', 10, parent_guid='R')
+        _add(tree, 'B', 11, parent_guid='A')
+        tree.guid_to_processnode_map['R'].last_seen = 300
+        for guid in 'AB':
+            tree.guid_to_processnode_map[guid].last_seen = 100
+        evicted = _run(tree.evict(max_age=50, now=310))
+        assert sorted(evicted) == ['A', 'B']
+        assert sorted(_run(tree.restore(evicted))) == ['A', 'B']
+        assert _run(tree.find_subtree('R')) == ['R', 'A', 'B']
+        assert _run(tree.find_original_processes_by_pid(11)) == [1]
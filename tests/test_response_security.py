@@ -46,11 +46,16 @@ class TestElasticatSecurity:
                 if isinstance(func, ast.Attribute) and func.attr in requests_methods:
                     if isinstance(func.value, ast.Name) and func.value.id == 'requests':
                         is_requests_call = True
+                    # requests.Session calls, e.g. self.es_session.post()
+                    if isinstance(func.value, ast.Attribute) and func.value.attr.endswith('session'):
+                        is_requests_call = True
+                    if isinstance(func.value, ast.Name) and func.value.id.endswith('session'):
+                        is_requests_call = True
                 if is_requests_call:
                     keyword_names = [kw.arg for kw in node.keywords if kw.arg is not None]
                     if 'timeout' not in keyword_names:
                         line = getattr(node, 'lineno', '?')
-                        missing.append(f'line {line}: requests.{func.attr}()')
+                        missing.append(f'line {line}: {ast.unparse(func)}()')
         if missing:
             pytest.fail(
                 f'elasticat.py has requests calls without timeout: {"; ".join(missing)}'